@@ -1,10 +1,30 @@
 import asyncio
+import base64
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
 import logging
 import os
-from typing import List, Optional, Dict, Any
+import re
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Any, Tuple, Deque, Literal, Callable, Awaitable, Iterator, AsyncIterator, AnyStr
 
 from mcp.server import FastMCP
 
+try:  # 可选依赖：安装 orjson 时用于 RPC 帧与结果缓存的 JSON 编解码
+    import orjson
+except ImportError:
+    orjson = None
+
 # 注意：STDIO 模式下不要向 stdout 打印任何非协议内容，使用 logging（写入 stderr）记录日志
 logging.basicConfig(level=logging.INFO)
 
@@ -14,52 +34,861 @@ EXE_PATH = r"J:\\mcp\\codeql-n1ght.exe"
 
 app = FastMCP(APP_NAME)
 
+# create_database 的可选取值
+_DECOMPILERS = frozenset({"procyon", "fernflower"})
+_DEPS = frozenset({"none", "all"})
+
+# 路径解析缓存：原始输入 -> (绝对路径, 检查时间, stat 结果或 None)；stat 结果在 TTL 内复用。
+# exe_path 来自工具参数，条目数按先进先出限制在 _RESOLVE_CACHE_MAX 以内
+_RESOLVE_CACHE: Dict[str, Tuple[str, float, Optional[os.stat_result]]] = {}
+_CACHE_TTL = 5.0
+_RESOLVE_CACHE_MAX = 64
+
+
+def _env_max_procs(raw: Optional[str], default: int = 4) -> int:
+    """解析 CODEQL_N1GHT_MAX_PROCS：非整数时记录错误并使用默认值，小于 1 时按 1 处理（0 会让所有调用永远排队）。"""
+    if raw is None or not raw.strip():
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        logging.error("Invalid CODEQL_N1GHT_MAX_PROCS=%r (expected a positive integer), using %d", raw, default)
+        return default
+    if value < 1:
+        logging.error("CODEQL_N1GHT_MAX_PROCS=%d must be at least 1, using 1", value)
+        return 1
+    return value
+
+
+# 子进程并发上限：超出的调用在信号量上排队，避免并发工具调用同时拉起大量进程
+MAX_PROCS = _env_max_procs(os.environ.get("CODEQL_N1GHT_MAX_PROCS"))
+_PROC_SEM = asyncio.Semaphore(MAX_PROCS)
+# 按调用方指定的 max_parallel（小于 MAX_PROCS 时）复用的分组信号量
+_PROC_SEMS: Dict[int, asyncio.Semaphore] = {}
+
+# 常驻 RPC 模式（codeql-n1ght.exe -rpc）：需显式开启，且每个可执行文件只探测一次
+RPC_ENABLED = os.environ.get("CODEQL_N1GHT_RPC", "").lower() in {"1", "true", "yes"}
+_RPC_PROBE_TIMEOUT = 5.0
+# RPC 响应整行携带 stdout/stderr，行长度上限需明显高于 asyncio 默认的 64 KiB
+_RPC_LINE_LIMIT = 64 << 20
+
+# 子进程输出随到随存，每路只保留末尾 MAX_OUTPUT_BYTES 字节，避免长时间扫描的日志撑爆内存
+MAX_OUTPUT_BYTES = 4 << 20
+
+# 输出解码方式：utf-8（默认，非法字节替换）、latin-1（逐字节映射，无需校验）、none（返回 base64 原始字节）
+DecodeMode = Literal["utf-8", "latin-1", "none"]
+
+# clean_output=True 时去除的 ANSI 转义序列（含 \x1b[?25l 等隐藏/显示光标的私有模式序列）；被 \r 覆盖掉的进度条由 _clean_output 按行处理
+_ANSI_RE = re.compile(rb"\x1b\[[0-9;?]*[A-Za-z]")
+_ANSI_RE_STR = re.compile(_ANSI_RE.pattern.decode())
+
+# 结果缓存：成功结果按 (可执行文件/输入文件的 mtime+size, 命令, cwd, 输出选项) 缓存，并持久化到 sqlite 供重启后复用
+RESULT_TTL = float(os.environ.get("CODEQL_N1GHT_RESULT_TTL", "3600"))
+_RESULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".cache", APP_NAME, "results.sqlite")
+_RESULT_CACHE_MAX = 64
+# 这些参数后面跟随的是输入文件/目录，其元数据参与缓存键
+_INPUT_FLAGS = frozenset({"-db", "-ql", "-database", "-dir"})
+
+# Windows 下子进程放入独立进程组，超时时先发 CTRL_BREAK_EVENT 留出优雅退出时间，再强制 kill。
+# POSIX 下关闭 close_fds：Python 创建的 fd 默认不可继承（PEP 446），子进程只会拿到显式传入的管道，
+# 省去 fork 后逐个关闭 fd 的开销，并允许走 posix_spawn/vfork 快速路径。
+_SPAWN_KWARGS: Dict[str, Any] = (
+    {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if sys.platform == "win32" else {"close_fds": False}
+)
+_KILL_GRACE = 3.0
 
-def _resolve_exe_path(custom_path: Optional[str]) -> str:
-    """返回可执行文件的绝对路径，优先使用传入路径。兼容类似 "/j:/mcp/codeql-n1ght.exe" 的写法。"""
-    path = (custom_path or EXE_PATH).strip()
+
+def _json_dumps(obj: Any) -> bytes:
+    """紧凑 JSON 编码为 UTF-8 字节；优先使用 orjson。"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+_json_loads: Callable[[Any], Any] = orjson.loads if orjson is not None else json.loads
+
+
+def _normalize_exe_path(path: str) -> str:
+    """兼容类似 "/j:/mcp/codeql-n1ght.exe" 的写法；已是绝对路径时不再调用 abspath（省去 getcwd）。"""
+    path = path.strip()
     if path.startswith("/") and len(path) > 2 and path[2] == ":":
         path = path[1:]
-    return os.path.abspath(path)
-
+    return path if os.path.isabs(path) else os.path.abspath(path)
 
-async def _run_subprocess(cmd: List[str], cwd: Optional[str], timeout: Optional[float]) -> Dict[str, Any]:
-    """以异步方式运行子进程，捕获 stdout/stderr，返回 {returncode, stdout, stderr, timeout}."""
-    logging.info("Running command: %s", " ".join(cmd))
-    if cwd:
-        logging.info("Working directory: %s", cwd)
 
-    proc = await asyncio.create_subprocess_exec(
-        *cmd,
-        cwd=cwd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
+def _resolve_and_stat(custom_path: Optional[str]) -> Tuple[str, Optional[os.stat_result]]:
+    """
+    返回 (可执行文件路径, stat 结果)，文件不存在时 stat 为 None。优先使用传入路径。
 
+    解析结果按原始输入缓存；stat 结果在 _CACHE_TTL 内复用，过期后只需一次 os.stat。
+    stat 同时作为结果缓存中可执行文件的新鲜度依据。
+    """
+    key = custom_path or EXE_PATH
+    now = time.monotonic()
+    cached = _RESOLVE_CACHE.get(key)
+    if cached is not None:
+        path, ts, st = cached
+        if now - ts < _CACHE_TTL:
+            return path, st
+    else:
+        path = _normalize_exe_path(key)
     try:
-        stdout_b, stderr_b = await asyncio.wait_for(proc.communicate(), timeout=timeout)
-        timed_out = False
-    except asyncio.TimeoutError:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    _RESOLVE_CACHE.pop(key, None)
+    _RESOLVE_CACHE[key] = (path, now, st)
+    while len(_RESOLVE_CACHE) > _RESOLVE_CACHE_MAX:
+        del _RESOLVE_CACHE[next(iter(_RESOLVE_CACHE))]
+    return path, st
+
+
+# 默认路径在导入时解析并 stat 一次
+_resolve_and_stat(None)
+
+
+_EXE_NOT_FOUND_TEMPLATE = "Executable not found: {}"
+_TIMEOUT_TEMPLATE = "Process timeout after {} seconds"
+_CANCELLED_MSG = "Process cancelled"
+_RPC_LOST_TEMPLATE = "RPC daemon exited during request: {}"
+
+
+@dataclass(frozen=True, slots=True)
+class ProcResult:
+    """一次调用的结果；工具函数在返回给 MCP 前通过 to_dict() 转为 {returncode, stdout, stderr, timeout}。"""
+
+    returncode: Optional[int]
+    stdout: str
+    stderr: str
+    timeout: bool
+    # 仅 decode="none" 时有值
+    stdout_b64: Optional[str] = None
+    stderr_b64: Optional[str] = None
+    # 超出 tail_bytes 被丢弃的输出量（stdout 与 stderr 合计）
+    dropped_bytes: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        d: Dict[str, Any] = {
+            "returncode": self.returncode,
+            "stdout": self.stdout,
+            "stderr": self.stderr,
+            "timeout": self.timeout,
+        }
+        if self.stdout_b64 is not None:
+            d["stdout_b64"] = self.stdout_b64
+            d["stderr_b64"] = self.stderr_b64
+        if self.dropped_bytes:
+            d["truncated"] = True
+            d["dropped_bytes"] = self.dropped_bytes
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "ProcResult":
+        """to_dict() 的逆操作，用于读取持久化的结果缓存。"""
+        return cls(
+            d["returncode"],
+            d["stdout"],
+            d["stderr"],
+            d["timeout"],
+            d.get("stdout_b64"),
+            d.get("stderr_b64"),
+            d.get("dropped_bytes", 0),
+        )
+
+
+def _err(stderr: str, timeout: bool = False) -> ProcResult:
+    """未能得到进程退出码时（参数错误、可执行文件缺失、超时）的统一返回结果。"""
+    return ProcResult(None, "", stderr, timeout)
+
+
+@contextlib.asynccontextmanager
+async def _proc_slot(max_parallel: Optional[int]) -> AsyncIterator[None]:
+    """
+    占用一个子进程名额：总是受全局上限 MAX_PROCS 约束，max_parallel 只能在其之下进一步收紧。
+
+    先在较窄的分组信号量上排队，再取全局名额，避免排队中的调用占住全局名额。
+    """
+    if not isinstance(max_parallel, int) or max_parallel < 1 or max_parallel >= MAX_PROCS:
+        async with _PROC_SEM:
+            yield
+        return
+    sem = _PROC_SEMS.get(max_parallel)
+    if sem is None:
+        sem = _PROC_SEMS[max_parallel] = asyncio.Semaphore(max_parallel)
+    async with sem, _PROC_SEM:
+        yield
+
+
+class _DaemonProc:
+    """
+    常驻的 codeql-n1ght.exe -rpc 子进程，复用同一进程处理多次调用以省去进程启动开销。
+
+    协议为逐行 JSON：
+      请求 {"id": int, "argv": [...], "cwd": str|null, "tail_bytes": int}
+      取消 {"id": int, "cancel": true}：终止该 id 的命令，并照常以该 id 回应
+      响应 {"id": int, "returncode": int, "stdout": str, "stderr": str, "dropped_bytes": int（可选）}
+
+    tail_bytes 请常驻进程在发送前只保留 stdout/stderr 的末尾部分，dropped_bytes 为其丢弃的量；
+    忽略该字段的实现仍受 _RPC_LINE_LIMIT 约束，由调用方读入整行后再截取。
+    """
+
+    def __init__(self, exe: str) -> None:
+        self.exe = exe
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.stdin_lock = asyncio.Lock()
+        self.pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._reader: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        """进程在运行且响应读取循环仍在工作（stdout 关闭后新请求不会再得到响应）。"""
+        return self.proc is not None and self.proc.returncode is None and not self._reader.done()
+
+    async def start(self) -> None:
+        self.proc = await asyncio.create_subprocess_exec(
+            self.exe,
+            "-rpc",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=_RPC_LINE_LIMIT,
+        )
+        self._reader = asyncio.create_task(self._reader_loop(self.proc.stdout))
+
+    async def _reader_loop(self, stream: asyncio.StreamReader) -> None:
+        """按 id 将响应分发给等待中的 Future；进程退出或读取出错时结束进程，并让所有未完成请求失败。"""
+        try:
+            while True:
+                try:
+                    line = await stream.readline()
+                except (ValueError, asyncio.LimitOverrunError) as e:
+                    # 超过 _RPC_LINE_LIMIT 的响应无法继续按行解析，常驻进程只能作废
+                    logging.warning("RPC response exceeds %d bytes, restarting daemon: %s", _RPC_LINE_LIMIT, e)
+                    break
+                if not line:
+                    break
+                try:
+                    msg = _json_loads(line)
+                    fut = self.pending.pop(msg["id"], None)
+                except (ValueError, KeyError, TypeError):
+                    logging.warning("Ignoring malformed RPC line: %r", line[:200])
+                    continue
+                if fut is not None and not fut.done():
+                    fut.set_result(msg)
+        finally:
+            if self.proc.returncode is None:
+                with contextlib.suppress(ProcessLookupError):
+                    self.proc.kill()
+            for fut in self.pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("codeql-n1ght RPC daemon exited"))
+            self.pending.clear()
+
+    async def request(
+        self, argv: List[str], cwd: Optional[str], timeout: Optional[float], tail_bytes: int = MAX_OUTPUT_BYTES
+    ) -> ProcResult:
+        """
+        发送一次请求。请求未能写入时抛出 ConnectionError，调用方可以安全地改用子进程执行；
+        写入之后常驻进程退出则返回错误结果。超时或被取消时通过 _abort 终止该请求的命令。
+        """
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        line = _json_dumps({"id": req_id, "argv": argv, "cwd": cwd, "tail_bytes": tail_bytes}) + b"\n"
+        async with self.stdin_lock:
+            if not self.alive or self.proc.stdin.is_closing():
+                raise ConnectionError("codeql-n1ght RPC daemon exited")
+            self.pending[req_id] = fut
+            self.proc.stdin.write(line)
+        try:
+            await self.proc.stdin.drain()
+            msg = await asyncio.wait_for(fut, timeout=timeout)
+        except asyncio.TimeoutError:
+            await self._abort(req_id)
+            return _err(_TIMEOUT_TEMPLATE.format(timeout), timeout=True)
+        except asyncio.CancelledError:
+            await self._abort(req_id)
+            raise
+        except (OSError, ConnectionError) as e:
+            return _err(_RPC_LOST_TEMPLATE.format(e))
+        finally:
+            self.pending.pop(req_id, None)
+        return ProcResult(
+            msg.get("returncode"),
+            msg.get("stdout") or "",
+            msg.get("stderr") or "",
+            False,
+            dropped_bytes=msg.get("dropped_bytes") or 0,
+        )
+
+    async def _abort(self, req_id: int) -> None:
+        """
+        终止一个已送达的请求：发送取消消息，常驻进程在 _KILL_GRACE 内回应该 id 即视为命令已终止；
+        否则只能结束整个常驻进程，此时其中其他进行中的请求也会失败。
+        """
+        ack = asyncio.get_running_loop().create_future()
+        self.pending[req_id] = ack
         try:
-            proc.kill()
-        except ProcessLookupError:
+            async with self.stdin_lock:
+                if self.alive:
+                    self.proc.stdin.write(_json_dumps({"id": req_id, "cancel": True}) + b"\n")
+            await asyncio.wait_for(ack, timeout=_KILL_GRACE)
+            return
+        except (asyncio.TimeoutError, OSError, ConnectionError):
             pass
+        finally:
+            self.pending.pop(req_id, None)
+        logging.warning("RPC daemon ignored cancel for request %d, restarting it", req_id)
+        await self.close()
+
+    async def close(self) -> None:
+        if self.proc is not None and self.proc.returncode is None:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+            await self.proc.wait()
+
+
+# 可执行文件路径 -> 常驻进程 / 是否支持 -rpc 的探测结果
+_DAEMONS: Dict[str, _DaemonProc] = {}
+_RPC_SUPPORTED: Dict[str, bool] = {}
+_DAEMON_LOCK = asyncio.Lock()
+
+
+async def _get_daemon(exe: str) -> Optional[_DaemonProc]:
+    """返回可用的常驻进程；未开启、不支持 -rpc 或启动失败时返回 None。"""
+    if not RPC_ENABLED or _RPC_SUPPORTED.get(exe) is False:
+        return None
+    daemon = _DAEMONS.get(exe)
+    if daemon is not None and daemon.alive:
+        return daemon
+
+    async with _DAEMON_LOCK:
+        daemon = _DAEMONS.get(exe)
+        if daemon is not None:
+            if daemon.alive:
+                return daemon
+            # 替换前结束并回收已失效的旧进程
+            del _DAEMONS[exe]
+            await daemon.close()
+        daemon = _DaemonProc(exe)
+        try:
+            await daemon.start()
+            if exe not in _RPC_SUPPORTED:
+                # 首次启动时用 --version 探测是否真正支持 RPC 协议
+                probe = await daemon.request(["--version"], None, _RPC_PROBE_TIMEOUT)
+                if probe.returncode is None:
+                    raise ConnectionError(probe.stderr)
+        except (OSError, ConnectionError) as e:
+            logging.info("RPC mode unavailable for %s: %s", exe, e)
+            await daemon.close()
+            _RPC_SUPPORTED[exe] = False
+            return None
+        _RPC_SUPPORTED[exe] = True
+        _DAEMONS[exe] = daemon
+        return daemon
+
+
+async def _run_rpc(
+    cmd: List[str], cwd: Optional[str], timeout: Optional[float], max_parallel: Optional[int], tail_bytes: int
+) -> Optional[ProcResult]:
+    """
+    尝试通过常驻进程执行命令，与子进程共用并发名额。
+
+    常驻进程不可用或请求未能送达时返回 None，由调用方回退到子进程；
+    请求送达后的失败直接作为结果返回，不再重复执行，避免命令的副作用发生两次。
+    """
+    daemon = await _get_daemon(cmd[0])
+    if daemon is None:
+        return None
+    async with _proc_slot(max_parallel):
+        try:
+            return await daemon.request(cmd[1:], cwd, timeout, tail_bytes)
+        except ConnectionError as e:
+            logging.warning("RPC daemon unavailable, falling back to subprocess: %s", e)
+            return None
+
+
+def _clean_output(data: AnyStr) -> AnyStr:
+    """
+    去除 ANSI 转义序列，每行只保留最后一个单独 \r 之后的内容（\r\n 换行保留）。
+
+    按 \n 切分后用 rfind 定位，整体线性时间；不用正则匹配 \r，避免超长无换行输出上的回溯。
+    """
+    if isinstance(data, bytes):
+        data, nl, cr = _ANSI_RE.sub(b"", data), b"\n", b"\r"
+    else:
+        data, nl, cr = _ANSI_RE_STR.sub("", data), "\n", "\r"
+    if cr not in data:
+        return data
+    lines = data.split(nl)
+    last = len(lines) - 1
+    for i, line in enumerate(lines):
+        # \r\n 中的 \r 属于换行本身，不视为覆盖
+        end = len(line) - 1 if i < last and line.endswith(cr) else len(line)
+        k = line.rfind(cr, 0, end)
+        if k >= 0:
+            lines[i] = line[k + 1 :]
+    return nl.join(lines)
+
+
+class _LazyJoin:
+    """日志参数：仅在记录真正输出时才拼接命令行。"""
+
+    __slots__ = ("_cmd",)
+
+    def __init__(self, cmd: List[str]) -> None:
+        self._cmd = cmd
+
+    def __str__(self) -> str:
+        return " ".join(self._cmd)
+
+
+def _parallel_args(
+    goroutine: bool,
+    max_goroutines: Optional[int],
+    threads: Optional[int],
+    clean_cache: bool,
+) -> Tuple[str, ...]:
+    """-database / -scan 共用的并行与缓存控制参数。"""
+    return (
+        *(("-goroutine",) if goroutine else ()),
+        *(("-max-goroutines", str(max_goroutines)) if isinstance(max_goroutines, int) else ()),
+        *(("-threads", str(threads)) if isinstance(threads, int) else ()),
+        *(("-clean-cache",) if clean_cache else ()),
+    )
+
+
+# 参数拼装是纯函数：客户端通常反复以相同参数组合调用，按参数组合缓存拼好的参数元组，
+# 重复调用时跳过全部分支判断与校验
+@functools.lru_cache(maxsize=128)
+def _database_args(
+    target: str,
+    decompiler: Optional[str],
+    extra_src_dir: Optional[str],
+    deps: Optional[str],
+    goroutine: bool,
+    max_goroutines: Optional[int],
+    threads: Optional[int],
+    clean_cache: bool,
+) -> Tuple[str, ...]:
+    """-database 的参数；decompiler / deps 取值非法时抛出 ValueError。"""
+    # 常见情况下传入值已是规范写法，直接命中集合即可跳过归一化
+    dec = decompiler if decompiler in _DECOMPILERS else (decompiler.strip().lower() if decompiler else None)
+    if dec is not None and dec not in _DECOMPILERS:
+        raise ValueError(f"Invalid decompiler: {decompiler}. Expected 'procyon' or 'fernflower'")
+
+    d = deps if deps in _DEPS else (deps.strip().lower() if deps else None)
+    if d is not None and d not in _DEPS:
+        raise ValueError(f"Invalid deps: {deps}. Expected 'none' or 'all' or leave empty to use interactive TUI")
+
+    return (
+        "-database",
+        target,
+        *(("-decompiler", dec) if dec else ()),
+        *(("-dir", extra_src_dir) if extra_src_dir else ()),
+        *(("-deps", d) if d else ()),
+        # 新增：并行与缓存控制参数
+        *_parallel_args(goroutine, max_goroutines, threads, clean_cache),
+    )
+
+
+@functools.lru_cache(maxsize=128)
+def _scan_args(
+    db: Optional[str],
+    ql: Optional[str],
+    goroutine: bool,
+    max_goroutines: Optional[int],
+    threads: Optional[int],
+    clean_cache: bool,
+) -> Tuple[str, ...]:
+    """-scan 的参数。"""
+    return (
+        "-scan",
+        *(("-db", db) if db else ()),
+        *(("-ql", ql) if ql else ()),
+        *_parallel_args(goroutine, max_goroutines, threads, clean_cache),
+    )
+
+
+class _ChildProtocol(asyncio.SubprocessProtocol):
+    """
+    loop.subprocess_exec 使用的协议：stdout/stderr 数据到达时直接写入缓冲区，每路只保留最后 max_bytes 字节。
+
+    exited 在进程退出时完成；finished 在进程退出且管道全部关闭（输出读完）后完成。
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        loop = asyncio.get_running_loop()
+        self.max_bytes = max_bytes
+        self.bufs: Dict[int, Deque[bytes]] = {1: deque(), 2: deque()}
+        self.sizes = {1: 0, 2: 0}
+        # 被丢弃的字节数（两路合计）
+        self.dropped = 0
+        self.exited: asyncio.Future = loop.create_future()
+        self.finished: asyncio.Future = loop.create_future()
+
+    def pipe_data_received(self, fd: int, data: bytes) -> None:
+        buf = self.bufs[fd]
+        buf.append(data)
+        size = self.sizes[fd] + len(data)
+        while size > self.max_bytes:
+            excess = size - self.max_bytes
+            head = buf[0]
+            if len(head) <= excess:
+                buf.popleft()
+                size -= len(head)
+                self.dropped += len(head)
+            else:
+                buf[0] = head[excess:]
+                size -= excess
+                self.dropped += excess
+        self.sizes[fd] = size
+
+    def process_exited(self) -> None:
+        if not self.exited.done():
+            self.exited.set_result(None)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.process_exited()
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+    def output(self, fd: int) -> bytes:
+        return b"".join(self.bufs[fd])
+
+
+def _decode_output(stdout_b: bytes, stderr_b: bytes, decode: DecodeMode) -> Dict[str, str]:
+    """按 decode 方式转换输出；none 时 stdout/stderr 置空，原始字节放在 stdout_b64/stderr_b64。"""
+    if decode == "none":
         return {
-            "returncode": None,
             "stdout": "",
-            "stderr": f"Process timeout after {timeout} seconds",
-            "timeout": True,
+            "stderr": "",
+            "stdout_b64": base64.b64encode(stdout_b).decode("ascii"),
+            "stderr_b64": base64.b64encode(stderr_b).decode("ascii"),
         }
+    if decode == "latin-1":
+        return {"stdout": stdout_b.decode("latin-1"), "stderr": stderr_b.decode("latin-1")}
+    return {"stdout": stdout_b.decode("utf-8", "replace"), "stderr": stderr_b.decode("utf-8", "replace")}
+
+
+async def _spawn(
+    cmd: List[str], cwd: Optional[str], max_bytes: int
+) -> Tuple[asyncio.SubprocessTransport, _ChildProtocol]:
+    """创建子进程（stdin 继承，stdout/stderr 为管道），输出由 _ChildProtocol 收集。"""
+    loop = asyncio.get_running_loop()
+    return await loop.subprocess_exec(
+        lambda: _ChildProtocol(max_bytes),
+        *cmd,
+        cwd=cwd,
+        stdin=None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        **_SPAWN_KWARGS,
+    )
+
+
+async def _terminate(transport: asyncio.SubprocessTransport, protocol: _ChildProtocol) -> None:
+    """终止子进程并回收：等待其退出后关闭 transport，避免僵尸进程与句柄泄漏。"""
+    if sys.platform == "win32" and transport.get_returncode() is None:
+        with contextlib.suppress(ProcessLookupError, OSError, asyncio.TimeoutError):
+            transport.send_signal(signal.CTRL_BREAK_EVENT)
+            await asyncio.wait_for(asyncio.shield(protocol.exited), timeout=_KILL_GRACE)
+    if transport.get_returncode() is None:
+        with contextlib.suppress(ProcessLookupError):
+            transport.kill()
+    await protocol.exited
+    # 孙进程可能仍持有管道：关闭 transport 释放 stdout/stderr，否则 finished 要等到孙进程退出
+    transport.close()
+    await protocol.finished
 
-    stdout = stdout_b.decode(errors="replace") if stdout_b else ""
-    stderr = stderr_b.decode(errors="replace") if stderr_b else ""
 
-    return {
-        "returncode": proc.returncode,
-        "stdout": stdout,
-        "stderr": stderr,
-        "timeout": timed_out,
-    }
+# 取消令牌：token -> 事件，以及使用该 token 的调用数；同一 token 可由多个调用共享，cancel 时一起终止
+_CANCELS: Dict[str, asyncio.Event] = {}
+_CANCEL_USERS: Dict[str, int] = {}
+
+
+@contextlib.contextmanager
+def _cancel_scope(token: Optional[str]) -> Iterator[Optional[asyncio.Event]]:
+    """在调用期间登记 cancel_token，返回对应事件；未传 token 时返回 None。"""
+    if not token:
+        yield None
+        return
+    ev = _CANCELS.get(token)
+    if ev is None:
+        ev = _CANCELS[token] = asyncio.Event()
+    _CANCEL_USERS[token] = _CANCEL_USERS.get(token, 0) + 1
+    try:
+        yield ev
+    finally:
+        _CANCEL_USERS[token] -= 1
+        if not _CANCEL_USERS[token]:
+            del _CANCEL_USERS[token]
+            del _CANCELS[token]
+
+
+async def _wait_or_cancel(
+    protocol: _ChildProtocol, timeout: Optional[float], cancel_event: Optional[asyncio.Event]
+) -> bool:
+    """等待子进程退出且输出读完；cancel_event 先触发时返回 True，超时抛出 asyncio.TimeoutError。"""
+    if cancel_event is None:
+        await asyncio.wait_for(asyncio.shield(protocol.finished), timeout=timeout)
+        return False
+    t_cancel = asyncio.create_task(cancel_event.wait())
+    try:
+        done, _ = await asyncio.wait(
+            {protocol.finished, t_cancel}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        t_cancel.cancel()
+    if not done:
+        raise asyncio.TimeoutError
+    return protocol.finished not in done
+
+
+# 进行中的可合并调用：(cmd, cwd, timeout, 输出选项) -> [执行任务, 等待者数量]
+_INFLIGHT: Dict[tuple, list] = {}
+
+
+async def _coalesced(key: tuple, factory: Callable[[], Awaitable[ProcResult]]) -> ProcResult:
+    """相同 key 的并发调用共享同一次执行；全部等待者都取消时才取消底层任务。"""
+    entry = _INFLIGHT.get(key)
+    if entry is None:
+        entry = [asyncio.create_task(factory()), 0]
+        _INFLIGHT[key] = entry
+
+        def _forget(_: asyncio.Task, entry: list = entry) -> None:
+            if _INFLIGHT.get(key) is entry:
+                del _INFLIGHT[key]
+
+        entry[0].add_done_callback(_forget)
+    else:
+        logging.debug("Joining in-flight call: %s", _LazyJoin(key[0]))
+
+    entry[1] += 1
+    try:
+        return await asyncio.shield(entry[0])
+    except asyncio.CancelledError:
+        if entry[1] == 1:
+            # 最后一个等待者离开：取消底层任务，并让后续调用重新发起执行
+            entry[0].cancel()
+            if _INFLIGHT.get(key) is entry:
+                del _INFLIGHT[key]
+        raise
+    finally:
+        entry[1] -= 1
+
+
+_result_cache: Dict[str, Tuple[float, ProcResult]] = {}
+_result_db: Optional[sqlite3.Connection] = None
+_result_db_failed = False
+# sqlite 读写（含 commit 时的 fsync 与大结果的 JSON 编解码）放到单线程执行器中，不阻塞事件循环
+_RESULT_DB_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="codeql-n1ght-cache")
+
+
+def _stat_key(path: str) -> Tuple[str, Optional[int], Optional[int]]:
+    """以 (path, mtime_ns, size) 作为文件内容的快速代理；不存在时后两项为 None。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path, None, None
+    return path, st.st_mtime_ns, st.st_size
+
+
+def _input_paths(args: List[str], cwd: Optional[str]) -> List[str]:
+    """提取 -db / -ql / -database / -dir 后的输入路径（相对路径按 cwd 解析）。"""
+    return [
+        os.path.abspath(os.path.join(cwd, value) if cwd else value)
+        for flag, value in zip(args, args[1:])
+        if flag in _INPUT_FLAGS
+    ]
+
+
+def _result_key(
+    cmd: List[str], cwd: Optional[str], *opts: Any, exe_stat: Optional[os.stat_result] = None
+) -> Optional[str]:
+    """计算结果缓存键；传入 exe_stat 时复用，不再重复 stat。可执行文件无法 stat 时返回 None（不缓存）。"""
+    exe = (cmd[0], exe_stat.st_mtime_ns, exe_stat.st_size) if exe_stat is not None else _stat_key(cmd[0])
+    if exe[1] is None:
+        return None
+    parts = [
+        exe,
+        cmd[1:],
+        cwd,
+        _stat_key(cwd) if cwd else None,
+        [_stat_key(p) for p in _input_paths(cmd[1:], cwd)],
+        opts,
+    ]
+    return hashlib.sha256(_json_dumps(parts)).hexdigest()
+
+
+def _result_store() -> Optional[sqlite3.Connection]:
+    """懒加载持久化缓存；目录不可写等情况下只记录一次警告并退化为内存缓存。仅在 _RESULT_DB_POOL 线程中调用。"""
+    global _result_db, _result_db_failed
+    if _result_db is None and not _result_db_failed:
+        try:
+            os.makedirs(os.path.dirname(_RESULT_DB_PATH), exist_ok=True)
+            _result_db = sqlite3.connect(_RESULT_DB_PATH, check_same_thread=False)
+            _result_db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, ts REAL NOT NULL, value TEXT NOT NULL)"
+            )
+        except (OSError, sqlite3.Error) as e:
+            logging.warning("Result cache persistence disabled: %s", e)
+            _result_db = None
+            _result_db_failed = True
+    return _result_db
+
+
+def _db_get(key: str) -> Optional[Tuple[float, ProcResult]]:
+    db = _result_store()
+    if db is None:
+        return None
+    try:
+        row = db.execute("SELECT ts, value FROM results WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error:
+        return None
+    return None if row is None else (row[0], ProcResult.from_dict(_json_loads(row[1])))
+
+
+def _db_put(key: str, ts: float, res: ProcResult) -> None:
+    db = _result_store()
+    if db is not None:
+        with contextlib.suppress(sqlite3.Error):
+            db.execute("DELETE FROM results WHERE ts < ?", (ts - RESULT_TTL,))
+            db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, ts, _json_dumps(res.to_dict())))
+            db.commit()
+
+
+async def _cache_get(key: str) -> Optional[ProcResult]:
+    hit = _result_cache.get(key)
+    if hit is None:
+        hit = await asyncio.get_running_loop().run_in_executor(_RESULT_DB_POOL, _db_get, key)
+    if hit is None:
+        return None
+    if time.time() - hit[0] >= RESULT_TTL:
+        _result_cache.pop(key, None)
+        return None
+    _result_cache[key] = hit
+    return hit[1]
+
+
+def _cache_put(key: str, res: ProcResult) -> None:
+    """写入内存缓存；持久化（JSON 编码与 commit）交给后台线程，调用方不等待。"""
+    ts = time.time()
+    _result_cache.pop(key, None)
+    _result_cache[key] = (ts, res)
+    while len(_result_cache) > _RESULT_CACHE_MAX:
+        del _result_cache[next(iter(_result_cache))]
+    _RESULT_DB_POOL.submit(_db_put, key, ts, res)
+
+
+async def _run_subprocess(
+    cmd: List[str],
+    cwd: Optional[str],
+    timeout: Optional[float],
+    max_parallel: Optional[int] = None,
+    tail_bytes: Optional[int] = None,
+    decode: DecodeMode = "utf-8",
+    clean_output: bool = False,
+    coalesce: bool = False,
+    cache: bool = False,
+    cancel_event: Optional[asyncio.Event] = None,
+    exe_stat: Optional[os.stat_result] = None,
+) -> ProcResult:
+    """
+    以异步方式运行子进程，捕获 stdout/stderr，返回 ProcResult(returncode, stdout, stderr, timeout).
+
+    stdout/stderr 各自只保留末尾 tail_bytes 字节（默认 MAX_OUTPUT_BYTES），并按 decode 方式解码；
+    clean_output=True 时在解码前去除 ANSI 转义与 \r 进度条。
+    coalesce=True 时，与正在执行的完全相同的调用合并为一次执行（仅用于无副作用或幂等的命令）。
+    cache=True 时，输入未变化且在 RESULT_TTL 内的成功结果直接复用，不再启动子进程。
+    cancel_event 被触发时终止子进程并返回取消结果；此时不合并调用，也不走 RPC 常驻进程。
+    exe_stat 为调用方已取得的可执行文件 stat，用作结果缓存键的一部分。
+    """
+    if cache:
+        key = _result_key(cmd, cwd, tail_bytes, decode, clean_output, exe_stat=exe_stat)
+        if key is not None:
+            hit = await _cache_get(key)
+            if hit is not None:
+                logging.debug("Result cache hit: %s", _LazyJoin(cmd))
+                return hit
+            res = await _run_subprocess(
+                cmd,
+                cwd,
+                timeout,
+                max_parallel=max_parallel,
+                tail_bytes=tail_bytes,
+                decode=decode,
+                clean_output=clean_output,
+                coalesce=coalesce,
+                cancel_event=cancel_event,
+            )
+            if res.returncode == 0 and not res.timeout:
+                _cache_put(key, res)
+            return res
+
+    if coalesce and cancel_event is None:
+        key = (tuple(cmd), cwd, timeout, tail_bytes, decode, clean_output)
+        return await _coalesced(
+            key,
+            lambda: _run_subprocess(
+                cmd,
+                cwd,
+                timeout,
+                max_parallel=max_parallel,
+                tail_bytes=tail_bytes,
+                decode=decode,
+                clean_output=clean_output,
+            ),
+        )
+
+    logging.debug("Running command: %s", _LazyJoin(cmd))
+    if cwd:
+        logging.debug("Working directory: %s", cwd)
+    max_bytes = tail_bytes if isinstance(tail_bytes, int) and tail_bytes > 0 else MAX_OUTPUT_BYTES
+
+    res = await _run_rpc(cmd, cwd, timeout, max_parallel, max_bytes) if cancel_event is None else None
+    if res is not None:
+        if clean_output:
+            res = replace(res, stdout=_clean_output(res.stdout), stderr=_clean_output(res.stderr))
+        # 常驻进程未按 tail_bytes 截取时在此补截；RPC 输出已是文本，按字符截取末尾
+        dropped = res.dropped_bytes + max(len(res.stdout) - max_bytes, 0) + max(len(res.stderr) - max_bytes, 0)
+        res = replace(res, stdout=res.stdout[-max_bytes:], stderr=res.stderr[-max_bytes:], dropped_bytes=dropped)
+        if decode == "none":
+            res = replace(res, **_decode_output(res.stdout.encode(), res.stderr.encode(), decode))
+        return res
+
+    async with _proc_slot(max_parallel):
+        # 排队等待期间已被取消的调用不再启动子进程
+        if cancel_event is not None and cancel_event.is_set():
+            return _err(_CANCELLED_MSG)
+        transport, protocol = await _spawn(cmd, cwd, max_bytes)
+
+        try:
+            cancelled = await _wait_or_cancel(protocol, timeout, cancel_event)
+        except asyncio.TimeoutError:
+            await _terminate(transport, protocol)
+            return _err(_TIMEOUT_TEMPLATE.format(timeout), timeout=True)
+        except asyncio.CancelledError:
+            await _terminate(transport, protocol)
+            raise
+        if cancelled:
+            await _terminate(transport, protocol)
+            return _err(_CANCELLED_MSG)
+        transport.close()
+
+    dropped = protocol.dropped
+    if dropped:
+        logging.info("Output truncated to last %d bytes per stream (%d bytes dropped)", max_bytes, dropped)
+    stdout_b = protocol.output(1)
+    stderr_b = protocol.output(2)
+    if clean_output:
+        stdout_b = _clean_output(stdout_b)
+        stderr_b = _clean_output(stderr_b)
+    return ProcResult(
+        returncode=transport.get_returncode(), timeout=False, dropped_bytes=dropped, **_decode_output(stdout_b, stderr_b, decode)
+    )
 
 
 @app.tool()
@@ -68,6 +897,11 @@ async def run_codeql_n1ght(
     exe_path: Optional[str] = None,
     cwd: Optional[str] = None,
     timeout_seconds: Optional[float] = 600.0,
+    max_parallel: Optional[int] = None,
+    tail_bytes: Optional[int] = None,
+    decode: DecodeMode = "utf-8",
+    clean_output: bool = False,
+    cancel_token: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     通用执行接口：直接传入参数数组，运行 codeql-n1ght.exe。
@@ -76,43 +910,81 @@ async def run_codeql_n1ght(
     - exe_path 可选，覆盖默认可执行路径。
     - cwd 可选，子进程工作目录。
     - timeout_seconds 超时（秒）。
+    - max_parallel 可选，本次调用所在并发组的子进程上限，只能低于全局上限 CODEQL_N1GHT_MAX_PROCS（默认 4）。
+    - tail_bytes 可选，stdout/stderr 各只保留最后 N 字节（默认 4 MiB）。
+    - decode 输出解码方式：utf-8 | latin-1 | none（返回 stdout_b64/stderr_b64）。
+    - clean_output 为 True 时去除 ANSI 转义序列与 \r 覆盖的进度条。
+    - cancel_token 可选，之后可调用 cancel(token) 终止本次执行。
     """
-    resolved_path = _resolve_exe_path(exe_path)
-    if not os.path.exists(resolved_path):
-        return {
-            "returncode": None,
-            "stdout": "",
-            "stderr": f"Executable not found: {resolved_path}",
-            "timeout": False,
-        }
+    resolved_path, exe_stat = _resolve_and_stat(exe_path)
+    if exe_stat is None:
+        return _err(_EXE_NOT_FOUND_TEMPLATE.format(resolved_path)).to_dict()
 
     args = args or []
     cmd = [resolved_path, *args]
-    return await _run_subprocess(cmd, cwd=cwd, timeout=timeout_seconds)
+    with _cancel_scope(cancel_token) as cancel_event:
+        res = await _run_subprocess(
+            cmd,
+            cwd=cwd,
+            timeout=timeout_seconds,
+            max_parallel=max_parallel,
+            tail_bytes=tail_bytes,
+            decode=decode,
+            clean_output=clean_output,
+            cancel_event=cancel_event,
+        )
+    return res.to_dict()
+
+
+# (可执行文件路径, mtime_ns, size) -> version() 探测出的可用参数（--version 或 --help）；可执行文件被替换后自动失效
+_VERSION_FLAG_CACHE: Dict[Tuple[str, int, int], str] = {}
+
+
+def _version_ok(flag: str, res: ProcResult) -> bool:
+    """--version 需退出码为 0 且有 stdout；--help 的用法说明可能写在 stderr，只看退出码。"""
+    return res.returncode == 0 and (flag == "--help" or bool(res.stdout))
 
 
 @app.tool()
 async def version(
     exe_path: Optional[str] = None,
     timeout_seconds: Optional[float] = 60.0,
+    cache: bool = True,
 ) -> Dict[str, Any]:
-    """获取可执行文件版本或帮助信息：先尝试 --version，失败回退 --help。"""
-    resolved_path = _resolve_exe_path(exe_path)
-    if not os.path.exists(resolved_path):
-        return {
-            "returncode": None,
-            "stdout": "",
-            "stderr": f"Executable not found: {resolved_path}",
-            "timeout": False,
-        }
+    """
+    获取可执行文件版本或帮助信息：先尝试 --version，失败回退 --help。
 
-    # 先尝试 --version
-    res = await _run_subprocess([resolved_path, "--version"], cwd=None, timeout=timeout_seconds)
-    if res.get("returncode") == 0 and res.get("stdout"):
-        return res
+    成功的参数按可执行文件记住，之后只运行一次；记住的参数失败时重新完整探测。cache=False 时忽略结果缓存。
+    """
+    resolved_path, exe_stat = _resolve_and_stat(exe_path)
+    if exe_stat is None:
+        return _err(_EXE_NOT_FOUND_TEMPLATE.format(resolved_path)).to_dict()
+
+    run = functools.partial(
+        _run_subprocess, cwd=None, timeout=timeout_seconds, coalesce=True, cache=cache, exe_stat=exe_stat
+    )
+    flag_key = (resolved_path, exe_stat.st_mtime_ns, exe_stat.st_size)
+
+    # 已探测过的可执行文件直接使用上次可用的参数，只启动一次子进程
+    flag = _VERSION_FLAG_CACHE.get(flag_key)
+    if flag is not None:
+        res = await run([resolved_path, flag])
+        if _version_ok(flag, res):
+            return res.to_dict()
+        _VERSION_FLAG_CACHE.pop(flag_key, None)
+
+    # 先尝试 --version（刚刚失败的就是它时跳过）
+    if flag != "--version":
+        res = await run([resolved_path, "--version"])
+        if _version_ok("--version", res):
+            _VERSION_FLAG_CACHE[flag_key] = "--version"
+            return res.to_dict()
 
     # 回退 --help
-    return await _run_subprocess([resolved_path, "--help"], cwd=None, timeout=timeout_seconds)
+    res = await run([resolved_path, "--help"])
+    if _version_ok("--help", res):
+        _VERSION_FLAG_CACHE[flag_key] = "--help"
+    return res.to_dict()
 
 
 @app.tool()
@@ -123,29 +995,26 @@ async def install_environment(
     exe_path: Optional[str] = None,
     cwd: Optional[str] = None,
     timeout_seconds: Optional[float] = 3600.0,
+    cancel_token: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     一键安装环境：等价于命令行
       ./codeql_n1ght -install [-jdk <url>] [-ant <url>] [-codeql <url>]
     """
-    resolved_path = _resolve_exe_path(exe_path)
-    if not os.path.exists(resolved_path):
-        return {
-            "returncode": None,
-            "stdout": "",
-            "stderr": f"Executable not found: {resolved_path}",
-            "timeout": False,
-        }
-
-    args: List[str] = ["-install"]
-    if jdk_url:
-        args += ["-jdk", jdk_url]
-    if ant_url:
-        args += ["-ant", ant_url]
-    if codeql_url:
-        args += ["-codeql", codeql_url]
+    resolved_path, exe_stat = _resolve_and_stat(exe_path)
+    if exe_stat is None:
+        return _err(_EXE_NOT_FOUND_TEMPLATE.format(resolved_path)).to_dict()
 
-    return await _run_subprocess([resolved_path, *args], cwd=cwd, timeout=timeout_seconds)
+    cmd = [
+        resolved_path,
+        "-install",
+        *(("-jdk", jdk_url) if jdk_url else ()),
+        *(("-ant", ant_url) if ant_url else ()),
+        *(("-codeql", codeql_url) if codeql_url else ()),
+    ]
+    with _cancel_scope(cancel_token) as cancel_event:
+        res = await _run_subprocess(cmd, cwd=cwd, timeout=timeout_seconds, cancel_event=cancel_event)
+    return res.to_dict()
 
 
 @app.tool()
@@ -161,59 +1030,39 @@ async def create_database(
     exe_path: Optional[str] = None,
     cwd: Optional[str] = None,
     timeout_seconds: Optional[float] = 72000.0,
+    tail_bytes: Optional[int] = None,  # stdout/stderr 各只保留最后 N 字节
+    decode: DecodeMode = "utf-8",  # utf-8 | latin-1 | none(base64)
+    clean_output: bool = False,  # 去除 ANSI 转义与 \r 进度条
+    cancel_token: Optional[str] = None,  # 可通过 cancel(token) 终止
 ) -> Dict[str, Any]:
     """
     创建 CodeQL 数据库：等价命令
       ./codeql_n1ght -database <JAR|WAR|ZIP> [-decompiler procyon|fernflower] [-dir <path>] [-deps none|all] 
                      [-goroutine] [-max-goroutines N] [-threads N] [-clean-cache]
     """
-    resolved_path = _resolve_exe_path(exe_path)
-    if not os.path.exists(resolved_path):
-        return {
-            "returncode": None,
-            "stdout": "",
-            "stderr": f"Executable not found: {resolved_path}",
-            "timeout": False,
-        }
+    resolved_path, exe_stat = _resolve_and_stat(exe_path)
+    if exe_stat is None:
+        return _err(_EXE_NOT_FOUND_TEMPLATE.format(resolved_path)).to_dict()
+
+    try:
+        args = _database_args(
+            target, decompiler, extra_src_dir, deps, goroutine, max_goroutines, threads, clean_cache
+        )
+    except ValueError as e:
+        return _err(str(e)).to_dict()
 
-    args: List[str] = ["-database", target]
-
-    if decompiler:
-        dec = decompiler.lower().strip()
-        if dec not in {"procyon", "fernflower"}:
-            return {
-                "returncode": None,
-                "stdout": "",
-                "stderr": f"Invalid decompiler: {decompiler}. Expected 'procyon' or 'fernflower'",
-                "timeout": False,
-            }
-        args += ["-decompiler", dec]
-
-    if extra_src_dir:
-        args += ["-dir", extra_src_dir]
-
-    if deps:
-        d = deps.lower().strip()
-        if d not in {"none", "all"}:
-            return {
-                "returncode": None,
-                "stdout": "",
-                "stderr": f"Invalid deps: {deps}. Expected 'none' or 'all' or leave empty to use interactive TUI",
-                "timeout": False,
-            }
-        args += ["-deps", d]
-
-    # 新增：并行与缓存控制参数
-    if goroutine:
-        args += ["-goroutine"]
-    if isinstance(max_goroutines, int):
-        args += ["-max-goroutines", str(max_goroutines)]
-    if isinstance(threads, int):
-        args += ["-threads", str(threads)]
-    if clean_cache:
-        args += ["-clean-cache"]
-
-    return await _run_subprocess([resolved_path, *args], cwd=cwd, timeout=timeout_seconds)
+    cmd = [resolved_path, *args]
+    with _cancel_scope(cancel_token) as cancel_event:
+        res = await _run_subprocess(
+            cmd,
+            cwd=cwd,
+            timeout=timeout_seconds,
+            tail_bytes=tail_bytes,
+            decode=decode,
+            clean_output=clean_output,
+            cancel_event=cancel_event,
+        )
+    return res.to_dict()
 
 
 @app.tool()
@@ -227,35 +1076,48 @@ async def scan_database(
     exe_path: Optional[str] = None,
     cwd: Optional[str] = None,
     timeout_seconds: Optional[float] = 720000.0,
+    tail_bytes: Optional[int] = None,  # stdout/stderr 各只保留最后 N 字节
+    decode: DecodeMode = "utf-8",  # utf-8 | latin-1 | none(base64)
+    clean_output: bool = False,  # 去除 ANSI 转义与 \r 进度条
+    cache: bool = False,  # 显式开启后，输入路径未变化时复用上次成功的扫描结果
+    cancel_token: Optional[str] = None,  # 可通过 cancel(token) 终止
 ) -> Dict[str, Any]:
     """
     执行安全扫描：等价命令
       ./codeql_n1ght -scan [-db <path>] [-ql <path>] [-goroutine] [-max-goroutines N] [-threads N] [-clean-cache]
+
+    cache=True 时只比较 -db / -ql 路径本身的 mtime 与 size，目录内文件的修改不会使缓存失效，
+    命中时也不会重新生成扫描报告文件；仅在确认输入未变时开启。
     """
-    resolved_path = _resolve_exe_path(exe_path)
-    if not os.path.exists(resolved_path):
-        return {
-            "returncode": None,
-            "stdout": "",
-            "stderr": f"Executable not found: {resolved_path}",
-            "timeout": False,
-        }
+    resolved_path, exe_stat = _resolve_and_stat(exe_path)
+    if exe_stat is None:
+        return _err(_EXE_NOT_FOUND_TEMPLATE.format(resolved_path)).to_dict()
 
-    args: List[str] = ["-scan"]
-    if db:
-        args += ["-db", db]
-    if ql:
-        args += ["-ql", ql]
-    if goroutine:
-        args += ["-goroutine"]
-    if isinstance(max_goroutines, int):
-        args += ["-max-goroutines", str(max_goroutines)]
-    if isinstance(threads, int):
-        args += ["-threads", str(threads)]
-    if clean_cache:
-        args += ["-clean-cache"]
-
-    return await _run_subprocess([resolved_path, *args], cwd=cwd, timeout=timeout_seconds)
+    cmd = [resolved_path, *_scan_args(db, ql, goroutine, max_goroutines, threads, clean_cache)]
+    # 相同参数的并发扫描合并为一次、结果可缓存；-clean-cache 有副作用，两者都不启用
+    with _cancel_scope(cancel_token) as cancel_event:
+        res = await _run_subprocess(
+            cmd,
+            cwd=cwd,
+            timeout=timeout_seconds,
+            tail_bytes=tail_bytes,
+            decode=decode,
+            clean_output=clean_output,
+            coalesce=not clean_cache,
+            cache=cache and not clean_cache,
+            cancel_event=cancel_event,
+            exe_stat=exe_stat,
+        )
+    return res.to_dict()
+
+
+@app.tool()
+async def cancel(token: str) -> Dict[str, Any]:
+    """终止所有以该 cancel_token 发起、仍在执行中的调用；返回是否找到对应调用。"""
+    ev = _CANCELS.get(token)
+    if ev is not None:
+        ev.set()
+    return {"token": token, "cancelled": ev is not None}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import stat
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codeql_n1ght_mcp_server as server  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """每个用例使用独立的模块级状态：asyncio 原语与事件循环绑定，缓存不能在用例间泄漏。"""
+    monkeypatch.setattr(server, "_PROC_SEM", asyncio.Semaphore(server.MAX_PROCS))
+    monkeypatch.setattr(server, "_PROC_SEMS", {})
+    monkeypatch.setattr(server, "_DAEMON_LOCK", asyncio.Lock())
+    monkeypatch.setattr(server, "_RESULT_DB_PATH", str(tmp_path / "cache" / "results.sqlite"))
+    monkeypatch.setattr(server, "_result_db", None)
+    monkeypatch.setattr(server, "_result_db_failed", False)
+    for name in ("_RESOLVE_CACHE", "_DAEMONS", "_RPC_SUPPORTED", "_INFLIGHT", "_result_cache", "_VERSION_FLAG_CACHE"):
+        monkeypatch.setattr(server, name, {})
+    yield
+    if server._result_db is not None:
+        server._result_db.close()
+
+
+# 假的 codeql-n1ght 可执行文件：每次启动把参数追加写入 $FAKE_LOG，再按第一个参数决定行为
+FAKE_EXE = """#!{python}
+import json, os, sys, time
+
+
+def note(text):
+    log = os.environ.get("FAKE_LOG")
+    if log:
+        with open(log, "a") as f:
+            f.write(text + "\\n")
+
+
+args = sys.argv[1:]
+note(" ".join(args))
+cmd = args[0] if args else ""
+if cmd == "--version":
+    if os.environ.get("FAKE_NO_VERSION"):
+        sys.exit(2)
+    print("fake 1.0")
+elif cmd == "sleep":
+    print("started", flush=True)
+    time.sleep(float(args[1]))
+    print("done")
+elif cmd == "spew":
+    # 输出 N 字节的 0-9 循环序列，末尾字节可预期
+    n = int(args[1])
+    sys.stdout.write(("0123456789" * (n // 10 + 1))[:n])
+elif cmd == "orphan":
+    # 拉起一个继承 stdout/stderr 的孙进程并把其 pid 写入 args[1]，自身随后一直等待
+    import subprocess
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    with open(args[1], "w") as f:
+        f.write(str(child.pid))
+    print("started", flush=True)
+    time.sleep(30)
+elif cmd == "fail":
+    print("failed", file=sys.stderr)
+    sys.exit(3)
+elif cmd == "-rpc":
+    # 每个请求在独立线程中处理；RPC 请求同样记入日志（前缀 rpc），用于确认命令是否被执行了两次
+    import threading
+
+    out_lock = threading.Lock()
+    cancels = {{}}
+
+    def reply(req, stdout, returncode=0):
+        # 按请求中的 tail_bytes 在发送前截取，并报告丢弃的字节数；"untrimmed" 模拟不支持该字段的实现
+        resp = {{"id": req["id"], "returncode": returncode, "stdout": stdout, "stderr": ""}}
+        tail = req.get("tail_bytes")
+        if tail and len(stdout) > tail and req["argv"][-1:] != ["untrimmed"]:
+            resp["stdout"] = stdout[-tail:]
+            resp["dropped_bytes"] = len(stdout) - tail
+        with out_lock:
+            print(json.dumps(resp), flush=True)
+
+    def handle(req, cancelled):
+        argv = req["argv"]
+        note("rpc " + " ".join(argv))
+        if argv[:1] == ["die"]:
+            os._exit(1)
+        if argv[:1] == ["hang"]:
+            # 等到收到取消消息才回应
+            cancelled.wait(60)
+            reply(req, "cancelled", -1)
+        elif argv[:1] == ["stubborn"]:
+            # 忽略取消消息
+            time.sleep(60)
+        elif argv[:1] == ["slow"]:
+            time.sleep(float(argv[1]))
+            reply(req, "rpc " + " ".join(argv))
+        elif argv[:1] == ["huge"]:
+            reply(req, "x" * int(argv[1]))
+        else:
+            reply(req, "rpc " + " ".join(argv))
+
+    for line in sys.stdin:
+        req = json.loads(line)
+        if req.get("cancel"):
+            if req["id"] in cancels:
+                cancels[req["id"]].set()
+            continue
+        cancels[req["id"]] = threading.Event()
+        threading.Thread(target=handle, args=(req, cancels[req["id"]]), daemon=True).start()
+else:
+    print("ran", *args)
+"""
+
+
+@pytest.fixture
+def fake_exe(tmp_path, monkeypatch):
+    """返回假可执行文件路径；spawns() 返回至今每次启动的参数行。"""
+    if sys.platform == "win32":
+        pytest.skip("fake executable is a shebang script")
+    path = tmp_path / "codeql-n1ght"
+    path.write_text(FAKE_EXE.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    log = tmp_path / "spawns.log"
+    monkeypatch.setenv("FAKE_LOG", str(log))
+
+    class Fake(str):
+        def spawns(self):
+            return log.read_text().splitlines() if log.exists() else []
+
+    return Fake(path)
+
+
+@pytest.fixture
+def spawned(monkeypatch):
+    """记录 _spawn 创建的每个子进程 transport，用于检查其是否被结束并回收。"""
+    procs = []
+    real_spawn = server._spawn
+
+    async def spawn(cmd, cwd, max_bytes):
+        transport, protocol = await real_spawn(cmd, cwd, max_bytes)
+        procs.append(transport)
+        return transport, protocol
+
+    monkeypatch.setattr(server, "_spawn", spawn)
+    return procs
@@ -0,0 +1,64 @@
+import asyncio
+import os
+
+import codeql_n1ght_mcp_server as server
+
+
+def _flush_db():
+    # 持久化在后台线程异步完成，断言 sqlite 内容前先等队列清空
+    server._RESULT_DB_POOL.submit(lambda: None).result()
+
+
+def _scan(fake_exe, db, **kwargs):
+    return asyncio.run(server.scan_database(db=str(db), exe_path=fake_exe, **kwargs))
+
+
+def test_scan_is_not_cached_by_default(fake_exe, tmp_path):
+    db = tmp_path / "db"
+    db.mkdir()
+    first = _scan(fake_exe, db)
+    second = _scan(fake_exe, db)
+    assert first == second
+    assert first["returncode"] == 0
+    assert len(fake_exe.spawns()) == 2
+
+
+def test_scan_cache_hit_and_input_invalidation(fake_exe, tmp_path):
+    db = tmp_path / "db"
+    db.mkdir()
+    first = _scan(fake_exe, db, cache=True)
+    assert _scan(fake_exe, db, cache=True) == first
+    assert len(fake_exe.spawns()) == 1
+
+    st = os.stat(db)
+    os.utime(db, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert _scan(fake_exe, db, cache=True) == first
+    assert len(fake_exe.spawns()) == 2
+
+    # 输出选项不同视为不同的结果
+    _scan(fake_exe, db, cache=True, decode="latin-1")
+    assert len(fake_exe.spawns()) == 3
+
+
+def test_cache_persists_across_memory_eviction(fake_exe, tmp_path):
+    db = tmp_path / "db"
+    db.mkdir()
+    first = _scan(fake_exe, db, cache=True)
+    _flush_db()
+    server._result_cache.clear()
+    assert _scan(fake_exe, db, cache=True) == first
+    assert len(fake_exe.spawns()) == 1
+
+
+def test_failures_and_expired_entries_are_not_reused(fake_exe, monkeypatch):
+    run = lambda: asyncio.run(server._run_subprocess([fake_exe, "fail"], None, 10, cache=True))  # noqa: E731
+    assert run().returncode == 3
+    assert run().returncode == 3
+    assert len(fake_exe.spawns()) == 2
+
+    ok = lambda: asyncio.run(server._run_subprocess([fake_exe, "x"], None, 10, cache=True))  # noqa: E731
+    ok()
+    _flush_db()
+    monkeypatch.setattr(server, "RESULT_TTL", 0.0)
+    ok()
+    assert len(fake_exe.spawns()) == 4
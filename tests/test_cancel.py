@@ -0,0 +1,58 @@
+import asyncio
+import os
+import signal
+import time
+
+import codeql_n1ght_mcp_server as server
+
+
+def test_cancel_kills_and_reaps_the_child(fake_exe, spawned):
+    async def main():
+        call = asyncio.create_task(
+            server.run_codeql_n1ght(args=["sleep", "30"], exe_path=fake_exe, cancel_token="job")
+        )
+        while not spawned:
+            await asyncio.sleep(0.01)
+        ack = await server.cancel("job")
+        return ack, await call
+
+    ack, res = asyncio.run(main())
+    assert ack == {"token": "job", "cancelled": True}
+    assert res["stderr"] == server._CANCELLED_MSG
+    assert res["returncode"] is None
+    assert spawned[0].get_returncode() == -signal.SIGKILL
+    # 调用结束后 token 被注销
+    assert server._CANCELS == {}
+    assert asyncio.run(server.cancel("job"))["cancelled"] is False
+
+
+def test_cancel_while_queued_never_spawns(fake_exe, monkeypatch):
+    monkeypatch.setattr(server, "_PROC_SEM", asyncio.Semaphore(1))
+
+    async def main():
+        async with server._PROC_SEM:
+            call = asyncio.create_task(server.run_codeql_n1ght(args=["x"], exe_path=fake_exe, cancel_token="q"))
+            await asyncio.sleep(0.05)
+            await server.cancel("q")
+        return await call
+
+    assert asyncio.run(main())["stderr"] == server._CANCELLED_MSG
+    assert fake_exe.spawns() == []
+
+
+def test_timeout_reaps_child_even_when_grandchild_holds_the_pipe(fake_exe, tmp_path, spawned):
+    pid_file = tmp_path / "grandchild.pid"
+    start = time.monotonic()
+    try:
+        res = asyncio.run(
+            server.run_codeql_n1ght(args=["orphan", str(pid_file)], exe_path=fake_exe, timeout_seconds=1.0)
+        )
+        elapsed = time.monotonic() - start
+    finally:
+        if pid_file.exists():
+            os.kill(int(pid_file.read_text()), signal.SIGKILL)
+
+    assert res["timeout"] is True
+    assert res["stderr"] == server._TIMEOUT_TEMPLATE.format(1.0)
+    assert spawned[0].get_returncode() == -signal.SIGKILL
+    assert elapsed < 5.0
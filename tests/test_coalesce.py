@@ -0,0 +1,55 @@
+import asyncio
+import signal
+
+import codeql_n1ght_mcp_server as server
+
+
+def _call(fake_exe, seconds="0.3"):
+    return server._run_subprocess([fake_exe, "sleep", seconds], None, 10, coalesce=True)
+
+
+def test_concurrent_identical_calls_share_one_spawn(fake_exe):
+    async def main():
+        return await asyncio.gather(*(_call(fake_exe) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert results[0].stdout == "started\ndone\n"
+    assert results[0] == results[1] == results[2]
+    assert len(fake_exe.spawns()) == 1
+    assert server._INFLIGHT == {}
+
+
+def test_cancelling_one_waiter_keeps_the_shared_run(fake_exe):
+    async def main():
+        a = asyncio.create_task(_call(fake_exe))
+        b = asyncio.create_task(_call(fake_exe))
+        await asyncio.sleep(0.1)
+        a.cancel()
+        return await b, a.cancelled()
+
+    res, cancelled = asyncio.run(main())
+    assert cancelled
+    assert res.returncode == 0
+    assert len(fake_exe.spawns()) == 1
+
+
+def test_cancelling_all_waiters_kills_the_child(fake_exe, spawned):
+    async def main():
+        waiters = [asyncio.create_task(_call(fake_exe, "30")) for _ in range(2)]
+        while not spawned:
+            await asyncio.sleep(0.01)
+        (entry,) = server._INFLIGHT.values()
+        for w in waiters:
+            w.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait([entry[0]])
+        # 取消后同样的调用重新发起执行，而不是加入正在取消的任务
+        inflight_after_cancel = dict(server._INFLIGHT)
+        again = await _call(fake_exe, "0")
+        return inflight_after_cancel, again
+
+    inflight, again = asyncio.run(main())
+    assert inflight == {}
+    assert spawned[0].get_returncode() == -signal.SIGKILL
+    assert again.returncode == 0
+    assert len(spawned) == 2
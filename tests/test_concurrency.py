@@ -0,0 +1,61 @@
+import asyncio
+
+import codeql_n1ght_mcp_server as server
+
+
+def test_max_parallel_never_exceeds_global_cap(fake_exe, monkeypatch):
+    monkeypatch.setattr(server, "MAX_PROCS", 2)
+    monkeypatch.setattr(server, "_PROC_SEM", asyncio.Semaphore(2))
+    running = 0
+    peak = 0
+    real_spawn = server._spawn
+    real_wait = server._wait_or_cancel
+
+    async def counting_spawn(cmd, cwd, max_bytes):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        return await real_spawn(cmd, cwd, max_bytes)
+
+    async def counting_wait(protocol, timeout, cancel_event):
+        nonlocal running
+        try:
+            return await real_wait(protocol, timeout, cancel_event)
+        finally:
+            running -= 1
+
+    monkeypatch.setattr(server, "_spawn", counting_spawn)
+    monkeypatch.setattr(server, "_wait_or_cancel", counting_wait)
+
+    async def main():
+        return await asyncio.gather(
+            *(
+                server._run_subprocess([fake_exe, "sleep", "0.2"], None, 10, max_parallel=mp)
+                for mp in (None, 1, 2, 3, 5, 7)
+            )
+        )
+
+    results = asyncio.run(main())
+    assert all(r.returncode == 0 for r in results)
+    assert peak == 2
+
+
+def test_max_parallel_narrows_group(fake_exe):
+    async def main():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(
+            *(server._run_subprocess([fake_exe, "sleep", "0.3"], None, 10, max_parallel=1) for _ in range(3))
+        )
+        return loop.time() - start
+
+    assert asyncio.run(main()) >= 0.9
+
+
+def test_max_procs_env_is_validated(caplog):
+    assert server._env_max_procs(None) == 4
+    assert server._env_max_procs("8") == 8
+    assert server._env_max_procs("0") == 1
+    assert server._env_max_procs("-3") == 1
+    assert server._env_max_procs("lots") == 4
+    assert "Invalid CODEQL_N1GHT_MAX_PROCS='lots'" in caplog.text
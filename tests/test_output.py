@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+import codeql_n1ght_mcp_server as server
+
+
+def test_clean_output_strips_ansi_and_progress():
+    data = b"\x1b[32mok\x1b[0m\n\x1b[?25l 10%\r 50%\r100%\x1b[?25h\nline\r\nlast\r"
+    assert server._clean_output(data) == b"ok\n100%\nline\r\n"
+
+
+def test_clean_output_str_matches_bytes():
+    data = "a\rb\r\n\x1b[1;31mred\x1b[0m\rc"
+    assert server._clean_output(data) == server._clean_output(data.encode()).decode()
+    assert server._clean_output(data) == "b\r\nc"
+
+
+def test_clean_output_is_linear_on_long_lines():
+    # 4 MiB 且无换行：曾经的正则在这类输入上按平方时间回溯
+    data = b"x" * (4 << 20)
+    start = time.perf_counter()
+    assert server._clean_output(data) == data
+    assert server._clean_output(data + b"\rdone") == b"done"
+    assert server._clean_output(data.decode()) == data.decode()
+    assert time.perf_counter() - start < 2.0
+
+
+def test_child_protocol_keeps_tail_and_counts_dropped():
+    async def main():
+        protocol = server._ChildProtocol(250)
+        for i in range(10):
+            protocol.pipe_data_received(1, bytes([65 + i]) * 100)
+        protocol.pipe_data_received(2, b"err")
+        return protocol.output(1), protocol.output(2), protocol.dropped
+
+    out, err, dropped = asyncio.run(main())
+    assert out == b"H" * 50 + b"I" * 100 + b"J" * 100
+    assert err == b"err"
+    assert dropped == 750
+
+
+def test_truncation_is_reported_and_survives_the_cache(fake_exe):
+    def run():
+        return asyncio.run(server._run_subprocess([fake_exe, "spew", "300000"], None, 10, tail_bytes=1000, cache=True))
+
+    res = run()
+    assert res.stdout == ("0123456789" * 100)
+    out = res.to_dict()
+    assert out["truncated"] is True
+    assert out["dropped_bytes"] == 299000
+
+    server._RESULT_DB_POOL.submit(lambda: None).result()
+    server._result_cache.clear()
+    assert run().to_dict() == out
+    assert len(fake_exe.spawns()) == 1
+
+
+def test_untruncated_result_has_no_truncation_keys(fake_exe):
+    res = asyncio.run(server._run_subprocess([fake_exe, "spew", "10"], None, 10))
+    assert res.to_dict() == {"returncode": 0, "stdout": "0123456789", "stderr": "", "timeout": False}
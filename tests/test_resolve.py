@@ -0,0 +1,17 @@
+import codeql_n1ght_mcp_server as server
+
+
+def test_resolve_cache_is_bounded(tmp_path):
+    for i in range(server._RESOLVE_CACHE_MAX + 10):
+        path, st = server._resolve_and_stat(str(tmp_path / f"missing-{i}"))
+        assert st is None
+    assert len(server._RESOLVE_CACHE) == server._RESOLVE_CACHE_MAX
+    # 最早的条目先被淘汰
+    assert str(tmp_path / "missing-0") not in server._RESOLVE_CACHE
+    assert str(tmp_path / f"missing-{server._RESOLVE_CACHE_MAX + 9}") in server._RESOLVE_CACHE
+
+
+def test_resolve_reuses_stat_within_ttl(fake_exe):
+    first = server._resolve_and_stat(fake_exe)
+    assert first[1] is not None
+    assert server._resolve_and_stat(fake_exe)[1] is first[1]
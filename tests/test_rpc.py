@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+import codeql_n1ght_mcp_server as server
+
+
+@pytest.fixture(autouse=True)
+def rpc_enabled(monkeypatch):
+    monkeypatch.setattr(server, "RPC_ENABLED", True)
+
+
+def _run(fake_exe, *args, timeout=10):
+    async def main():
+        try:
+            return await server._run_subprocess([fake_exe, *args], None, timeout)
+        finally:
+            for daemon in server._DAEMONS.values():
+                await daemon.close()
+
+    return asyncio.run(main())
+
+
+def test_commands_go_through_daemon(fake_exe):
+    res = _run(fake_exe, "x", "y")
+    assert (res.returncode, res.stdout) == (0, "rpc x y")
+    assert fake_exe.spawns() == ["-rpc", "rpc --version", "rpc x y"]
+
+
+def test_daemon_exit_after_send_is_not_retried(fake_exe):
+    res = _run(fake_exe, "die")
+    assert res.returncode is None
+    assert res.stderr.startswith("RPC daemon exited during request")
+    # 命令只执行了一次：没有回退成子进程再跑一遍
+    assert fake_exe.spawns() == ["-rpc", "rpc --version", "rpc die"]
+
+
+def test_timeout_cancels_only_that_request(fake_exe):
+    async def main():
+        slow = asyncio.create_task(server._run_subprocess([fake_exe, "slow", "1"], None, 10))
+        res = await server._run_subprocess([fake_exe, "hang"], None, 0.3)
+        daemon = server._DAEMONS[fake_exe]
+        other = await slow
+        alive = daemon.alive
+        await daemon.close()
+        return res, other, alive
+
+    res, other, alive = asyncio.run(main())
+    assert res.timeout
+    assert other.stdout == "rpc slow 1"
+    assert alive
+
+
+def test_ignored_cancel_kills_and_restarts_daemon(fake_exe, monkeypatch):
+    monkeypatch.setattr(server, "_KILL_GRACE", 0.3)
+
+    async def main():
+        res = await server._run_subprocess([fake_exe, "stubborn"], None, 0.3)
+        first = server._DAEMONS[fake_exe]
+        assert first.proc.returncode is not None
+        again = await server._run_subprocess([fake_exe, "x"], None, 10)
+        second = server._DAEMONS[fake_exe]
+        await second.close()
+        return res, again, first is second
+
+    res, again, same = asyncio.run(main())
+    assert res.timeout
+    assert again.stdout == "rpc x"
+    assert not same
+
+
+def test_rpc_calls_share_the_concurrency_cap(fake_exe, monkeypatch):
+    monkeypatch.setattr(server, "_PROC_SEM", asyncio.Semaphore(1))
+
+    async def main():
+        await server._get_daemon(fake_exe)
+        async with server._PROC_SEM:
+            task = asyncio.create_task(server._run_subprocess([fake_exe, "x"], None, 10))
+            await asyncio.sleep(0.3)
+            blocked = not task.done()
+        res = await task
+        await server._DAEMONS[fake_exe].close()
+        return blocked, res
+
+    blocked, res = asyncio.run(main())
+    assert blocked
+    assert res.stdout == "rpc x"
+
+
+def test_oversized_response_restarts_daemon(fake_exe, monkeypatch):
+    monkeypatch.setattr(server, "_RPC_LINE_LIMIT", 1024)
+
+    async def main():
+        res = await server._run_subprocess([fake_exe, "huge", "4096"], None, 10)
+        old = server._DAEMONS[fake_exe]
+        await asyncio.wait_for(old.proc.wait(), 5)
+        again = await server._run_subprocess([fake_exe, "x"], None, 10)
+        new = server._DAEMONS[fake_exe]
+        await new.close()
+        return res, again, old, new
+
+    res, again, old, new = asyncio.run(main())
+    assert res.returncode is None
+    assert res.stderr.startswith("RPC daemon exited during request")
+    assert old.proc.returncode is not None
+    assert new is not old
+    assert again.stdout == "rpc x"
+
+
+def test_daemon_truncates_to_tail_bytes(fake_exe):
+    async def main():
+        trimmed = await server._run_subprocess([fake_exe, "huge", "5000"], None, 10, tail_bytes=100)
+        untrimmed = await server._run_subprocess([fake_exe, "huge", "5000", "untrimmed"], None, 10, tail_bytes=100)
+        await server._DAEMONS[fake_exe].close()
+        return trimmed, untrimmed
+
+    trimmed, untrimmed = asyncio.run(main())
+    for res in (trimmed, untrimmed):
+        assert res.stdout == "x" * 100
+        assert res.to_dict()["dropped_bytes"] == 4900
@@ -0,0 +1,32 @@
+import asyncio
+
+import codeql_n1ght_mcp_server as server
+
+
+def _version(fake_exe):
+    return asyncio.run(server.version(exe_path=fake_exe, cache=False))
+
+
+def test_memoized_flag_runs_once(fake_exe):
+    assert _version(fake_exe)["stdout"] == "fake 1.0\n"
+    assert _version(fake_exe)["stdout"] == "fake 1.0\n"
+    assert fake_exe.spawns() == ["--version", "--version"]
+
+
+def test_failing_memoized_flag_falls_back_to_probe(fake_exe, monkeypatch):
+    _version(fake_exe)
+    monkeypatch.setenv("FAKE_NO_VERSION", "1")
+    assert _version(fake_exe)["stdout"] == "ran --help\n"
+    assert _version(fake_exe)["stdout"] == "ran --help\n"
+    assert fake_exe.spawns() == ["--version", "--version", "--help", "--help"]
+
+
+def test_replaced_executable_is_probed_again(fake_exe, monkeypatch):
+    monkeypatch.setenv("FAKE_NO_VERSION", "1")
+    _version(fake_exe)
+    monkeypatch.delenv("FAKE_NO_VERSION")
+    with open(fake_exe, "a") as f:
+        f.write("# rebuilt\n")
+    server._RESOLVE_CACHE.clear()
+    assert _version(fake_exe)["stdout"] == "fake 1.0\n"
+    assert fake_exe.spawns() == ["--version", "--help", "--version"]